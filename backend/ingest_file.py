@@ -5,46 +5,73 @@ vector store for efficient retrieval. The module also includes error handling
 and logging to ensure robustness """
 import io
 from pathlib import Path
-from langchain_community.document_loaders import TextLoader, PyMuPDFLoader, DedocFileLoader
+import fitz
+from langchain_community.document_loaders import TextLoader, DedocFileLoader
 from langchain.schema import Document
-from store import get_doc_vector_store, text_splitter, clean_text
+from opensearchpy import helpers
+from store import client, embedding_model, create_index_if_not_exists, doc_index_name, get_text_splitter, clean_text
 from tempfile import NamedTemporaryFile
 import logging
 
 logger = logging.getLogger(__name__)
 
+def _load_pdf(file_bytes: bytes, filename: str):
+    """Load a PDF directly from bytes, one cleaned Document per non-empty page"""
+    docs = []
+    with fitz.open(stream=file_bytes, filetype="pdf") as pdf:
+        # Keep the PDF's own metadata (title, author, ...) like PyMuPDFLoader did
+        pdf_metadata = {k: v for k, v in (pdf.metadata or {}).items() if v}
+        total_pages = pdf.page_count
+        for i, page in enumerate(pdf):
+            cleaned_content = clean_text(page.get_text("text"))
+            if cleaned_content.strip():
+                docs.append(Document(
+                    page_content=cleaned_content,
+                    metadata={
+                        **pdf_metadata,
+                        "source": filename,
+                        "page": i,
+                        "total_pages": total_pages
+                    }
+                ))
+    return docs
+
 def load_and_split(file_bytes: bytes, filename: str):
     """Load file from bytes and split into documents"""
     suffix = Path(filename).suffix.lower()
     
-    with NamedTemporaryFile(delete=True, suffix=suffix) as tmp:
-        tmp.write(file_bytes)
-        tmp.flush()
-        
-        try:
-            if suffix == ".pdf":
-                loader = PyMuPDFLoader(tmp.name)
-                docs = loader.load()
-            elif suffix == ".txt":
+    # PDF pages are cleaned as they are read, other loaders are cleaned below
+    processed_docs = []
+    docs = []
+    
+    try:
+        if suffix == ".pdf":
+            processed_docs = _load_pdf(file_bytes, filename)
+        elif suffix == ".txt":
+            with NamedTemporaryFile(delete=True, suffix=suffix) as tmp:
+                tmp.write(file_bytes)
+                tmp.flush()
                 loader = TextLoader(tmp.name, encoding='utf-8')
                 docs = loader.load()
-            elif suffix in [".docx", ".doc"]:
-                # Use Docx2txtLoader for Word documents
+        elif suffix in [".docx", ".doc"]:
+            # Use DedocFileLoader for Word documents
+            with NamedTemporaryFile(delete=True, suffix=suffix) as tmp:
+                tmp.write(file_bytes)
+                tmp.flush()
                 loader = DedocFileLoader(tmp.name)
                 docs = loader.load()
-            else:
-                raise ValueError(f"Unsupported file type: {filename}")
-        
-        except Exception as e:
-            logger.error(f"Error loading {filename}: {str(e)}")
-            # Create a fallback document if loading fails
-            docs = [Document(
-                page_content=f"Error loading file: {filename}. Error: {str(e)}",
-                metadata={"source": filename, "error": True}
-            )]
+        else:
+            raise ValueError(f"Unsupported file type: {filename}")
+    
+    except Exception as e:
+        logger.error(f"Error loading {filename}: {str(e)}")
+        # Create a fallback document if loading fails
+        docs = [Document(
+            page_content=f"Error loading file: {filename}. Error: {str(e)}",
+            metadata={"source": filename, "error": True}
+        )]
     
     # Clean and process each document's text before splitting
-    processed_docs = []
     for doc in docs:
         if hasattr(doc, 'page_content') and doc.page_content:
             cleaned_content = clean_text(doc.page_content)
@@ -54,7 +81,7 @@ def load_and_split(file_bytes: bytes, filename: str):
     
     # Split documents into chunks
     if processed_docs:
-        return text_splitter.split_documents(processed_docs)
+        return get_text_splitter().split_documents(processed_docs)
     else:
         return []
 
@@ -68,7 +95,7 @@ def ingest_file_bytes(file_bytes: bytes, filename: str, tenant_id: str) -> int:
         tenant_id: Tenant identifier
         
     Returns:
-        int: Number of chunks processed
+        int: Number of chunks indexed
     """
     
     try:
@@ -79,8 +106,10 @@ def ingest_file_bytes(file_bytes: bytes, filename: str, tenant_id: str) -> int:
             logger.warning(f"No content extracted from {filename}")
             return 0
         
-        # Get the document vector store for this tenant
-        doc_vector_store = get_doc_vector_store(tenant_id)
+        # Confirm this tenant's document index exists with the knn mapping before
+        # bulk writing; raises (aborting the ingest) if it can't be confirmed
+        index_name = doc_index_name(tenant_id)
+        create_index_if_not_exists(index_name, verify=True)
 
 
         # Add metadata to each chunk
@@ -102,26 +131,50 @@ def ingest_file_bytes(file_bytes: bytes, filename: str, tenant_id: str) -> int:
                 "source_file": filename,
                 "type": "document"
             })
-            
-            # Clean up content whitespace
-            if hasattr(doc, 'page_content'):
-                doc.page_content = ' '.join(doc.page_content.split())
+            # Content whitespace is already collapsed by clean_text in load_and_split
         
-        # Split into batches for efficient indexing
-        BATCH_SIZE = 100
+        # Split into batches for efficient indexing: embed each batch in one
+        # call, then write it with a single bulk request
+        BATCH_SIZE = 500
         total_chunks = len(chunks)
+        indexed_chunks = 0
         
         for i in range(0, total_chunks, BATCH_SIZE):
             batch = chunks[i:i + BATCH_SIZE]
             try:
-                doc_vector_store.add_documents(batch)
-                logger.info(f"Indexed batch {i//BATCH_SIZE + 1} ({len(batch)} chunks) for {filename}")
+                vectors = embedding_model.embed_documents(
+                    [doc.page_content for doc in batch]
+                )
+                # Zero vectors (failed or empty embeddings) are rejected by the
+                # cosinesimil field, so leave those chunks out of the index
+                actions = [
+                    {
+                        "_index": index_name,
+                        "_source": {
+                            "text": doc.page_content,
+                            "vector_field": vector,
+                            "metadata": doc.metadata
+                        }
+                    }
+                    for doc, vector in zip(batch, vectors)
+                    if any(vector)
+                ]
+                skipped = len(batch) - len(actions)
+                if skipped:
+                    logger.warning(f"Skipped {skipped} chunks without an embedding in batch {i//BATCH_SIZE + 1} for {filename}")
+                if actions:
+                    helpers.bulk(client, actions, chunk_size=BATCH_SIZE, request_timeout=120)
+                indexed_chunks += len(actions)
+                logger.info(f"Indexed batch {i//BATCH_SIZE + 1} ({len(actions)} chunks) for {filename}")
             except Exception as e:
                 logger.error(f"Error indexing batch {i//BATCH_SIZE + 1} for {filename}: {str(e)}")
                 raise
         
-        logger.info(f"Successfully ingested {total_chunks} chunks from {filename} for tenant {tenant_id}")
-        return total_chunks
+        # Make the new chunks searchable right away, as add_documents did
+        client.indices.refresh(index=index_name)
+        
+        logger.info(f"Successfully ingested {indexed_chunks}/{total_chunks} chunks from {filename} for tenant {tenant_id}")
+        return indexed_chunks
         
     except Exception as e:
         logger.error(f"Error ingesting {filename} for tenant {tenant_id}: {str(e)}")
@@ -1,7 +1,13 @@
 #main.py
 import base64
+try:
+    # SIMD-accelerated base64, used for /ask-image when available
+    from pybase64 import b64encode_as_string
+except ImportError:
+    def b64encode_as_string(data: bytes) -> str:
+        return base64.b64encode(data).decode('ascii')
 from ollama_multimodel import OllamaMultimodal
-from ollama_embeddings import OllamaEmbeddings
+from ollama_embeddings import OllamaEmbeddings, quantize_int8
 from fastapi import FastAPI, File, UploadFile, Form, Body, HTTPException
 from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
@@ -9,14 +15,20 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from pathlib import Path
 from typing import List
+from collections import OrderedDict, deque
 import logging
 import asyncio
 import urllib3
 from langchain.prompts import PromptTemplate
 from langchain_community.llms import Ollama
 from langchain_ollama import ChatOllama
-from store import get_doc_vector_store, get_chat_history_vector_store, text_splitter
+from store import (
+    create_index_if_not_exists, index_known, doc_index_name, chat_history_index_name, load_known_indices,
+    asimilarity_search, asimilarity_search_reranked, aadd_chat_history, close_async_client,
+    embedding_model as store_embedding_model
+)
 from ingest_file import ingest_file_bytes
+import rerank
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -51,6 +63,23 @@ qwen3:8b
 # Multimodal LLM (if used elsewhere)
 multimodal_llm = OllamaMultimodal(model="gemma3:4b")
 
+# Maximum number of uploaded files ingested at the same time
+MAX_CONCURRENT_INGESTS = 4
+
+# Most recent chat turns kept in memory per tenant, for at most
+# MAX_HISTORY_TENANTS tenants (least recently active tenants are dropped)
+RECENT_HISTORY_TURNS = 20
+MAX_HISTORY_TENANTS = 1000
+recent_history: "OrderedDict[str, deque]" = OrderedDict()
+
+def remember_turn(tenant_id: str, turn: str):
+    """Append a chat turn to the tenant's in-memory buffer, evicting idle tenants"""
+    turns = recent_history.pop(tenant_id, None) or deque(maxlen=RECENT_HISTORY_TURNS)
+    turns.append(turn)
+    recent_history[tenant_id] = turns
+    while len(recent_history) > MAX_HISTORY_TENANTS:
+        recent_history.popitem(last=False)
+
 RAG_TEMPLATE = """
 <|SYSTEM|>
 You are a precise RAG assistant. Your sole task is to answer the user's `<QUESTION>` using ONLY the provided `<CONTEXT>`.
@@ -84,35 +113,63 @@ You are a precise RAG assistant. Your sole task is to answer the user's `<QUESTI
 
 prompt = PromptTemplate(input_variables=["context","sources_block", "chat_history", "question"], template=RAG_TEMPLATE)
 
+# Cache existing indices once so requests skip the per-call existence probe
+@app.on_event("startup")
+async def load_indices_on_startup():
+    await asyncio.to_thread(load_known_indices)
+
+# Compile the rerank kernel before serving, not inside the first request
+@app.on_event("startup")
+async def warm_up_rerank_on_startup():
+    await asyncio.to_thread(rerank.warm_up)
+
+# Close shared HTTP sessions
+@app.on_event("shutdown")
+async def close_sessions_on_shutdown():
+    await store_embedding_model.aclose()
+    await multimodal_llm.aclose()
+    await close_async_client()
+
 # Create or get indexes
 async def ensure_indexes_exist(tenant_id: str):
     # print(f"[DEBUG] Ensuring indexes exist for tenant: {tenant_id}")
-    doc_vector_store = get_doc_vector_store(tenant_id)
-    chat_history_vector_store = get_chat_history_vector_store(tenant_id)
-    # print(f"[DEBUG] Got doc_vector_store and chat_history_vector_store for tenant: {tenant_id}")
-    return doc_vector_store, chat_history_vector_store
+    # Known indices are a set lookup; only missing ones need the blocking PUT,
+    # which runs off the event loop
+    for index_name in (doc_index_name(tenant_id), chat_history_index_name(tenant_id)):
+        if not index_known(index_name):
+            await asyncio.to_thread(create_index_if_not_exists, index_name)
+    # print(f"[DEBUG] Indexes ready for tenant: {tenant_id}")
 
 # Get relevant chat history
-async def get_relevant_history(query: str, tenant_id: str, k: int = 3) -> str:
-    # print(f"[DEBUG] Fetching relevant chat history for tenant={tenant_id}, query='{query}'")
+async def get_relevant_history(query_vector: List[float], tenant_id: str, k: int = 3, search: bool = False) -> str:
+    # print(f"[DEBUG] Fetching relevant chat history for tenant={tenant_id}")
+    # Serve the last k turns from memory; only search OpenSearch when asked to
+    # or when this process has not seen enough turns (e.g. after a restart)
+    recent = recent_history.get(tenant_id)
+    if recent is not None:
+        recent_history.move_to_end(tenant_id)
+    if not search and recent and len(recent) >= k:
+        history_context = "\n".join(list(recent)[-k:])
+        return f"Relevant previous conversations:\n{history_context}"
+    
     try:
-        chat_history_vector_store = get_chat_history_vector_store(tenant_id)
-        docs = await asyncio.to_thread(
-            chat_history_vector_store.similarity_search, 
-            query, 
-            k=k
-        )
-        # print(f"[DEBUG] Retrieved {len(docs) if docs else 0} history docs")
-        if docs:
-            history_context = "\n".join([doc.page_content for doc in docs])
+        if not any(query_vector):
+            # Embedding failed; a zero vector can't be searched in a cosinesimil field
+            return "No relevant previous conversation history available."
+        # Stored history vectors are int8, so quantize the query the same way
+        query_int8 = quantize_int8([query_vector])[0].tolist()
+        hits = await asimilarity_search(chat_history_index_name(tenant_id), query_int8, k, source=["text"])
+        # print(f"[DEBUG] Retrieved {len(hits)} history docs")
+        if hits:
+            history_context = "\n".join([hit["_source"]["text"] for hit in hits])
             return f"Relevant previous conversations:\n{history_context}"
     except Exception as e:
         print(f"[ERROR] Error retrieving chat history for {tenant_id}: {str(e)}")
     return "No relevant previous conversation history available."
 
-async def get_relevant_documents(query: str, tenant_id: str, k: int = 10):
-    doc_vector_store = get_doc_vector_store(tenant_id)
-    docs = await asyncio.to_thread(doc_vector_store.similarity_search, query, k=k)
+async def get_relevant_documents(query_vector: List[float], tenant_id: str, k: int = 10, fetch_k: int = 50):
+    # Fetch fetch_k candidates and keep the k best after local reranking
+    docs = await asimilarity_search_reranked(tenant_id, query_vector, k=k, fetch_k=fetch_k)
     
     if not docs:
         return "\{empty\}", {}
@@ -136,12 +193,12 @@ async def get_relevant_documents(query: str, tenant_id: str, k: int = 10):
 async def store_chat_history(query: str, response: str, tenant_id: str):
     # print(f"[DEBUG] Storing chat history for tenant={tenant_id}, query='{query[:50]}...'")
     try:
-        chat_history_vector_store = get_chat_history_vector_store(tenant_id)
         chat_doc_content = f"Q: {query}\nA: {response}"
         
-        from langchain.schema import Document
-        chat_doc = Document(
-            page_content=chat_doc_content,
+        remember_turn(tenant_id, chat_doc_content)
+        await aadd_chat_history(
+            tenant_id,
+            chat_doc_content,
             metadata={
                 "type": "chat_history",
                 "tenant_id": tenant_id,
@@ -149,33 +206,35 @@ async def store_chat_history(query: str, response: str, tenant_id: str):
                 "response": response
             }
         )
-        
-        await asyncio.to_thread(chat_history_vector_store.add_documents, [chat_doc])
         # print(f"[DEBUG] Chat history stored for tenant={tenant_id}")
     except Exception as e:
         print(f"[ERROR] Error storing chat history for {tenant_id}: {str(e)}")
 
 # Stream response
-async def stream_rag_response(query: str, tenant_id: str):
+async def stream_rag_response(query: str, tenant_id: str, search_history: bool = False):
     # print(f"[DEBUG] stream_rag_response START tenant={tenant_id}, query='{query}'")
     await ensure_indexes_exist(tenant_id)
     
-    # Step 1: Get relevant chat history
-    chat_history = await get_relevant_history(query, tenant_id)
+    # Embed the query once (full precision) for both searches
+    query_vector = await store_embedding_model.base.aembed_query(query)
+    
+    # Step 1 + 3: Get relevant chat history and documents concurrently
+    chat_history, (context, sources) = await asyncio.gather(
+        get_relevant_history(query_vector, tenant_id, search=search_history),
+        get_relevant_documents(query_vector, tenant_id)
+    )
     # print(f"[DEBUG] Chat history context: {chat_history[:100]}...")
+    # print(f"[DEBUG] Retrieved context length: {len(context)}")
     
     # # Step 2: Combine history + query
     # combined_query = f"{chat_history}\n{query}" if chat_history != "No relevant previous conversation history available." else query
     # # print(f"[DEBUG] Combined query: {combined_query[:100]}...")
     
-    # Step 3: Get relevant documents
-    context, sources = await get_relevant_documents(query, tenant_id)
-    # print(f"[DEBUG] Retrieved context length: {len(context)}")
-    
-    # Step 4: Format prompt
+    # Step 4: Format prompt (sources_block is reused for the stored response)
+    sources_block = "\n".join(f"{k} {v}" for k, v in sources.items())
     formatted_prompt = prompt.format(
         context=context, 
-        sources_block="\n".join(f"{k} {v}" for k, v in sources.items()),
+        sources_block=sources_block,
         chat_history=chat_history, 
         question=query
     )
@@ -197,7 +256,6 @@ async def stream_rag_response(query: str, tenant_id: str):
     # # Step 6: Store chat history
     # response = "".join(response_chunks)
     # Append sources at the end
-    sources_block = "\n".join(f"{k} {v}" for k, v in sources.items())
     # print("Source Block: ",sources_block)
     response = "".join(response_chunks) + f"\n\nSources:\n{sources_block}"
     # print("FINAL RESPONSE:",response)
@@ -208,6 +266,8 @@ async def stream_rag_response(query: str, tenant_id: str):
 class Query(BaseModel):
     query: str
     tenantId: str
+    # Search all stored chat history instead of using the recent turns
+    searchHistory: bool = False
 
 @app.post("/ask-stream")
 async def stream_response(request: Query = Body(...)):
@@ -216,7 +276,7 @@ async def stream_response(request: Query = Body(...)):
     # print(f"[DEBUG] /ask-stream endpoint called with tenantId={request.tenantId}, query='{request.query}'")
     
     return StreamingResponse(
-        stream_rag_response(request.query, request.tenantId),
+        stream_rag_response(request.query, request.tenantId, request.searchHistory),
         media_type="text/event-stream",
         headers={'Cache-Control': 'no-cache'}
     )
@@ -243,23 +303,38 @@ async def ingest_multiple_files_api(
     total_chunks = 0
     errors = []
 
+    supported_files = []
     for file in files:
         if not file.filename.endswith((".pdf", ".txt", ".docx", ".doc")):
             errors.append(f"Unsupported file type: {file.filename}")
             continue
+        supported_files.append(file)
 
-        try:
+    # Ingest files concurrently, bounded so parsing and embedding overlap
+    # without flooding Ollama/OpenSearch
+    sem = asyncio.Semaphore(MAX_CONCURRENT_INGESTS)
+
+    async def _ingest_one(file: UploadFile) -> int:
+        async with sem:
             file_bytes = await file.read()
-            chunk_count = await asyncio.to_thread(
+            return await asyncio.to_thread(
                 ingest_file_bytes, 
                 file_bytes, 
                 file.filename, 
                 tenantId
             )
-            total_chunks += chunk_count
-        except Exception as e:
-            logger.error(f"Error ingesting {file.filename}: {str(e)}")
-            errors.append(f"Failed to ingest {file.filename}: {str(e)}")
+
+    results = await asyncio.gather(
+        *[_ingest_one(file) for file in supported_files],
+        return_exceptions=True
+    )
+
+    for file, result in zip(supported_files, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error ingesting {file.filename}: {str(result)}")
+            errors.append(f"Failed to ingest {file.filename}: {str(result)}")
+        else:
+            total_chunks += result
 
     return {
         "message": "Ingestion completed",
@@ -284,7 +359,7 @@ async def ask_image(
             if not file.filename:
                 continue
             image_bytes = await file.read()
-            image_b64 = base64.b64encode(image_bytes).decode('utf-8')
+            image_b64 = b64encode_as_string(image_bytes)
             images_data.append(image_b64)
         
         if not images_data:
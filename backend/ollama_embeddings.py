@@ -1,22 +1,69 @@
 from langchain.embeddings.base import Embeddings
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from array import array
+from collections import OrderedDict
 from typing import List
+import aiohttp
+import asyncio
+import hashlib
 import logging
+import threading
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# Shared zero-vector fallback (384 dimensions for all-minilm); treat as read-only
+_ZERO_LIST = [0.0] * 384
+
+# Number of texts sent per /api/embed request
+BATCH_SIZE = 64
+
+# Maximum number of in-flight /api/embed requests for the async methods
+MAX_CONCURRENT_REQUESTS = 16
+
+# Number of embeddings kept in the in-memory content-hash cache
+CACHE_SIZE = 20000
+
 class OllamaEmbeddings(Embeddings):
-    def __init__(self, model: str = "all-minilm:22m", base_url: str = "http://localhost:11434"):
+    def __init__(self, model: str = "all-minilm:22m", base_url: str = "http://localhost:11434", batch_size: int = BATCH_SIZE, cache_size: int = CACHE_SIZE):
         """
         Initialize Ollama embeddings client
         
         Args:
             model: The embedding model name (default: all-minilm:latest)
             base_url: Ollama server base URL (default: http://localhost:11434)
+            batch_size: Number of texts embedded per request (default: 64)
+            cache_size: Number of embeddings cached by content hash (default: 20000, 0 disables)
         """
         self.model = model
         self.base_url = base_url
-        self.endpoint = f"{base_url}/api/embeddings"
+        self.batch_size = batch_size
+        self.endpoint = f"{base_url}/api/embed"
+        
+        # Reuse pooled keep-alive connections across embedding calls
+        self._session = requests.Session()
+        self._session.headers.update({"Connection": "keep-alive"})
+        self._session.mount("http://", HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=32,
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.2,
+                status_forcelist=[502, 503, 504],
+                allowed_methods=frozenset(["POST"])  # Embedding requests are idempotent
+            )
+        ))
+        
+        # LRU cache of sha256(model:text) -> float32 vector, so re-ingested chunks skip Ollama
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[bytes, array]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        
+        # Shared aiohttp session for the async methods, created inside the event loop
+        self._async_session = None
+        self._async_semaphore = None
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """
@@ -28,15 +75,25 @@ class OllamaEmbeddings(Embeddings):
         Returns:
             List of embedding vectors
         """
-        embeddings = []
-        for text in texts:
+        keys = [self._cache_key(text) for text in texts]
+        embeddings = [self._cache_get(key) for key in keys]
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if len(misses) < len(texts):
+            logger.info(f"Embedding cache hit for {len(texts) - len(misses)}/{len(texts)} documents")
+        
+        # Only send cache misses to Ollama
+        for i in range(0, len(misses), self.batch_size):
+            batch = misses[i:i + self.batch_size]
             try:
-                embedding = self._embed(text)
-                embeddings.append(embedding)
+                vectors = self._embed_batch([texts[j] for j in batch])
+                for j, vector in zip(batch, vectors):
+                    embeddings[j] = vector
+                    self._cache_put(keys[j], vector)
             except Exception as e:
-                logger.error(f"Error embedding document: {str(e)}")
-                # Return zero vector as fallback
-                embeddings.append([0.0] * 384)  # Assuming 384 dimensions for all-minilm
+                logger.error(f"Error embedding document batch: {str(e)}")
+                # Return zero vectors as fallback
+                for j in batch:
+                    embeddings[j] = _ZERO_LIST
         
         return embeddings
 
@@ -55,7 +112,33 @@ class OllamaEmbeddings(Embeddings):
         except Exception as e:
             logger.error(f"Error embedding query: {str(e)}")
             # Return zero vector as fallback
-            return [0.0] * 384
+            return _ZERO_LIST
+
+    def _cache_key(self, text: str) -> bytes:
+        """Content hash of a text for the current model"""
+        return hashlib.sha256(f"{self.model}:{text}".encode("utf-8")).digest()
+
+    def _cache_get(self, key: bytes):
+        """Return a cached embedding as a list, or None on a miss"""
+        with self._cache_lock:
+            vector = self._cache.get(key)
+            if vector is None:
+                return None
+            self._cache.move_to_end(key)
+        return vector.tolist()
+
+    def _cache_put(self, key: bytes, embedding: List[float]):
+        """Store an embedding, evicting the least recently used entries"""
+        # Zero vectors (empty text or failed embedding) are never cached, so a
+        # retry or a later fix on the Ollama side gets a real embedding
+        if self.cache_size <= 0 or not any(embedding):
+            return
+        vector = array("f", embedding)
+        with self._cache_lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
 
     def _embed(self, text: str) -> List[float]:
         """
@@ -69,18 +152,41 @@ class OllamaEmbeddings(Embeddings):
         """
         if not text or not text.strip():
             logger.warning("Empty text provided for embedding")
-            return [0.0] * 384
+            return _ZERO_LIST
+        
+        return self._embed_batch([text])[0]
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Internal method to get embeddings for several texts in one Ollama request
+        
+        Args:
+            texts: Texts to embed
+            
+        Returns:
+            List of embedding vectors, in the same order as texts
+        """
+        if not texts:
+            return []
+        
+        # /api/embed rejects empty inputs, so only send the non-empty ones
+        embeddings = [_ZERO_LIST] * len(texts)
+        indices = [i for i, text in enumerate(texts) if text and text.strip()]
+        if len(indices) < len(texts):
+            logger.warning(f"{len(texts) - len(indices)} empty text(s) provided for embedding")
+        if not indices:
+            return embeddings
         
         payload = {
             "model": self.model,
-            "prompt": text.strip()
+            "input": [texts[i].strip() for i in indices]
         }
         
         try:
-            response = requests.post(
+            response = self._session.post(
                 self.endpoint,
                 json=payload,
-                timeout=30  # Add timeout to prevent hanging
+                timeout=120  # Add timeout to prevent hanging
             )
             
             if response.status_code != 200:
@@ -88,23 +194,125 @@ class OllamaEmbeddings(Embeddings):
                 logger.error(error_msg)
                 raise ValueError(error_msg)
             
-            result = response.json()
+            return self._fill_embeddings(embeddings, indices, response.json())
             
-            if "embedding" not in result:
-                error_msg = f"No embedding found in response: {result}"
-                logger.error(error_msg)
-                raise ValueError(error_msg)
+        except requests.exceptions.RequestException as e:
+            error_msg = f"Network error while getting embeddings: {str(e)}"
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+        except ValueError as e:
+            raise e
+        except Exception as e:
+            error_msg = f"Unexpected error during embedding: {str(e)}"
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of documents without blocking the event loop
+        
+        Batches are sent concurrently over a shared aiohttp connection pool,
+        at most MAX_CONCURRENT_REQUESTS at a time.
+        
+        Args:
+            texts: List of text strings to embed
             
-            embedding = result["embedding"]
+        Returns:
+            List of embedding vectors
+        """
+        keys = [self._cache_key(text) for text in texts]
+        embeddings = [self._cache_get(key) for key in keys]
+        misses = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if len(misses) < len(texts):
+            logger.info(f"Embedding cache hit for {len(texts) - len(misses)}/{len(texts)} documents")
+        
+        async def _embed_misses(batch: List[int]):
+            try:
+                vectors = await self._aembed_batch([texts[j] for j in batch])
+                for j, vector in zip(batch, vectors):
+                    embeddings[j] = vector
+                    self._cache_put(keys[j], vector)
+            except Exception as e:
+                logger.error(f"Error embedding document batch: {str(e)}")
+                # Return zero vectors as fallback
+                for j in batch:
+                    embeddings[j] = _ZERO_LIST
+        
+        # Only send cache misses to Ollama
+        await asyncio.gather(*[
+            _embed_misses(misses[i:i + self.batch_size])
+            for i in range(0, len(misses), self.batch_size)
+        ])
+        
+        return embeddings
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Embed a single query text without blocking the event loop
+        
+        Args:
+            text: Text string to embed
             
-            if not isinstance(embedding, list) or not embedding:
-                error_msg = f"Invalid embedding format: {type(embedding)}"
-                logger.error(error_msg)
-                raise ValueError(error_msg)
+        Returns:
+            Embedding vector
+        """
+        try:
+            return (await self._aembed_batch([text]))[0]
+        except Exception as e:
+            logger.error(f"Error embedding query: {str(e)}")
+            # Return zero vector as fallback
+            return _ZERO_LIST
+
+    async def _get_async_session(self) -> aiohttp.ClientSession:
+        """Lazily create the shared aiohttp session inside the running event loop"""
+        if self._async_session is None or self._async_session.closed:
+            self._async_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS),
+                timeout=aiohttp.ClientTimeout(total=120)  # Add timeout to prevent hanging
+            )
+            self._async_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        return self._async_session
+
+    async def _aembed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Async counterpart of _embed_batch
+        
+        Args:
+            texts: Texts to embed
+            
+        Returns:
+            List of embedding vectors, in the same order as texts
+        """
+        if not texts:
+            return []
+        
+        # /api/embed rejects empty inputs, so only send the non-empty ones
+        embeddings = [_ZERO_LIST] * len(texts)
+        indices = [i for i, text in enumerate(texts) if text and text.strip()]
+        if len(indices) < len(texts):
+            logger.warning(f"{len(texts) - len(indices)} empty text(s) provided for embedding")
+        if not indices:
+            return embeddings
+        
+        payload = {
+            "model": self.model,
+            "input": [texts[i].strip() for i in indices]
+        }
+        
+        try:
+            session = await self._get_async_session()
+            async with self._async_semaphore:
+                async with session.post(self.endpoint, json=payload) as response:
+                    if response.status != 200:
+                        error_msg = f"Ollama embedding request failed with status {response.status}: {await response.text()}"
+                        logger.error(error_msg)
+                        raise ValueError(error_msg)
+                    
+                    result = await response.json()
             
-            return embedding
+            return self._fill_embeddings(embeddings, indices, result)
             
-        except requests.exceptions.RequestException as e:
+        except aiohttp.ClientError as e:
             error_msg = f"Network error while getting embeddings: {str(e)}"
             logger.error(error_msg)
             raise ValueError(error_msg)
@@ -115,6 +323,45 @@ class OllamaEmbeddings(Embeddings):
             logger.error(error_msg)
             raise ValueError(error_msg)
 
+    def _fill_embeddings(self, embeddings: List[List[float]], indices: List[int], result: dict) -> List[List[float]]:
+        """
+        Validate an /api/embed response and place its vectors at the given indices
+        
+        Args:
+            embeddings: Output list, pre-filled with zero vectors
+            indices: Positions in embeddings of the texts that were sent
+            result: Decoded JSON response from Ollama
+            
+        Returns:
+            The filled embeddings list
+        """
+        if "embeddings" not in result:
+            error_msg = f"No embeddings found in response: {result}"
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+        
+        vectors = result["embeddings"]
+        
+        if not isinstance(vectors, list) or len(vectors) != len(indices):
+            error_msg = f"Invalid embeddings format: expected {len(indices)} vectors, got {type(vectors)}"
+            logger.error(error_msg)
+            raise ValueError(error_msg)
+        
+        for i, vector in zip(indices, vectors):
+            if not isinstance(vector, list) or not vector:
+                error_msg = f"Invalid embedding format: {type(vector)}"
+                logger.error(error_msg)
+                raise ValueError(error_msg)
+            embeddings[i] = vector
+        
+        return embeddings
+
+    async def aclose(self):
+        """Close the shared aiohttp session, if one was opened"""
+        if self._async_session is not None and not self._async_session.closed:
+            await self._async_session.close()
+        self._async_session = None
+
     def is_available(self) -> bool:
         """
         Check if Ollama server is available and has the model
@@ -128,4 +375,67 @@ class OllamaEmbeddings(Embeddings):
             return len(test_embedding) > 0
         except Exception as e:
             logger.warning(f"Ollama embeddings not available: {str(e)}")
-            return False
\ No newline at end of file
+            return False
+
+class Int8Embeddings(Embeddings):
+    def __init__(self, base: Embeddings):
+        """
+        Wrap an embeddings client so vectors are quantized to int8
+        
+        Each vector is scaled by its own max-abs value into [-127, 127]. This
+        matches OpenSearch "byte" knn_vector fields, and because the scale is
+        per vector it does not change cosine similarity beyond rounding.
+        
+        Args:
+            base: Embeddings client producing float vectors
+        """
+        self.base = base
+
+    def embed_documents(self, texts: List[str]) -> List[List[int]]:
+        """
+        Embed a list of documents as int8 vectors
+        
+        Args:
+            texts: List of text strings to embed
+            
+        Returns:
+            List of int8 embedding vectors
+        """
+        if not texts:
+            return []
+        return quantize_int8(self.base.embed_documents(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[int]:
+        """
+        Embed a single query text as an int8 vector
+        
+        Args:
+            text: Text string to embed
+            
+        Returns:
+            int8 embedding vector
+        """
+        return quantize_int8([self.base.embed_query(text)])[0].tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[int]]:
+        """Async version of embed_documents"""
+        if not texts:
+            return []
+        return quantize_int8(await self.base.aembed_documents(texts)).tolist()
+
+    async def aembed_query(self, text: str) -> List[int]:
+        """Async version of embed_query"""
+        return quantize_int8([await self.base.aembed_query(text)])[0].tolist()
+
+    async def aclose(self):
+        """Close the wrapped client's async resources, if it has any"""
+        if hasattr(self.base, "aclose"):
+            await self.base.aclose()
+
+
+def quantize_int8(vectors: List[List[float]]) -> np.ndarray:
+    """Quantize float vectors to int8 using per-vector max-abs scaling"""
+    arr = np.asarray(vectors, dtype=np.float32)
+    scale = np.abs(arr).max(axis=1, keepdims=True)
+    scale[scale == 0] = 1.0  # Zero-vector fallbacks stay zero; callers must not index or search them
+    return np.clip(np.rint(arr / scale * 127), -128, 127).astype(np.int8)
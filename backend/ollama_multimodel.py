@@ -1,10 +1,29 @@
 import aiohttp
-import json
+import asyncio
+import orjson
 
 class OllamaMultimodal:
     def __init__(self, model="gemma3:4b", api_url="http://localhost:11434/api/generate"):
         self.model = model
         self.api_url = api_url
+        # Shared session, created on first use inside the event loop
+        self._session = None
+        self._session_lock = asyncio.Lock()
+    
+    async def _get_session(self):
+        """Return the shared aiohttp session, creating it if needed"""
+        async with self._session_lock:
+            if self._session is None or self._session.closed:
+                self._session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=8, force_close=False, keepalive_timeout=60)
+                )
+            return self._session
+    
+    async def aclose(self):
+        """Close the shared aiohttp session, if one was opened"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
     
     async def stream(self, images_data, prompt):
         """
@@ -26,36 +45,35 @@ class OllamaMultimodal:
             "stream": True
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                self.api_url, 
-                json=payload,
-                headers={'Content-Type': 'application/json'}
-            ) as resp:
-                if resp.status != 200:
-                    error_text = await resp.text()
-                    raise Exception(f"Ollama API error: {resp.status} - {error_text}")
-                
-                # Stream the response
-                async for line in resp.content:
-                    if line:
-                        try:
-                            # Each line is a JSON object
-                            line_str = line.decode('utf-8').strip()
-                            if line_str:
-                                response_data = json.loads(line_str)
-                                
-                                # Extract the response text
-                                if 'response' in response_data:
-                                    yield response_data['response']
-                                
-                                # Check if this is the final response
-                                if response_data.get('done', False):
-                                    break
-                                    
-                        except json.JSONDecodeError:
-                            # Skip malformed JSON lines
-                            continue
-                        except Exception as e:
-                            print(f"Error processing chunk: {e}")
-                            continue
\ No newline at end of file
+        session = await self._get_session()
+        async with session.post(
+            self.api_url, 
+            json=payload,
+            headers={'Content-Type': 'application/json'}
+        ) as resp:
+            if resp.status != 200:
+                error_text = await resp.text()
+                raise Exception(f"Ollama API error: {resp.status} - {error_text}")
+            
+            # Stream the response
+            async for line in resp.content:
+                if line:
+                    try:
+                        # Each line is a JSON object; orjson parses the raw bytes
+                        # and tolerates the trailing newline
+                        response_data = orjson.loads(line)
+                        
+                        # Extract the response text
+                        if 'response' in response_data:
+                            yield response_data['response']
+                        
+                        # Check if this is the final response
+                        if response_data.get('done', False):
+                            break
+                            
+                    except orjson.JSONDecodeError:
+                        # Skip blank or malformed JSON lines
+                        continue
+                    except Exception as e:
+                        print(f"Error processing chunk: {e}")
+                        continue
\ No newline at end of file
@@ -0,0 +1,75 @@
+""" This module provides local cosine-similarity reranking of retrieved documents.
+Candidates come back from an approximate (HNSW, int8-quantized) kNN search;
+rescoring them here against the full-precision query vector restores the
+ordering that quantization and approximation may have blurred. Numba is used
+when installed, with a NumPy fallback otherwise """
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+    logger.warning("numba not installed, using NumPy for cosine reranking")
+
+
+def _cosine_scores_numpy(q: np.ndarray, M: np.ndarray) -> np.ndarray:
+    """Cosine similarity between q (d,) and every row of M (n, d)"""
+    norms = np.linalg.norm(M, axis=1) * np.linalg.norm(q)
+    norms[norms == 0] = 1.0
+    return (M @ q) / norms
+
+
+if njit is not None:
+    # Single-threaded: at ~50x384, thread-pool dispatch would cost more than the math
+    @njit(fastmath=True, cache=True)
+    def _cosine_scores(q, M):
+        n, d = M.shape
+        q_norm = 0.0
+        for j in range(d):
+            q_norm += q[j] * q[j]
+        q_norm = np.sqrt(q_norm)
+        scores = np.zeros(n, dtype=np.float32)
+        for i in range(n):
+            dot = 0.0
+            m_norm = 0.0
+            for j in range(d):
+                dot += q[j] * M[i, j]
+                m_norm += M[i, j] * M[i, j]
+            denom = q_norm * np.sqrt(m_norm)
+            if denom > 0.0:
+                scores[i] = dot / denom
+        return scores
+else:
+    _cosine_scores = _cosine_scores_numpy
+
+
+def cosine_topk(q, M, k: int) -> np.ndarray:
+    """
+    Indices of the k rows of M most cosine-similar to q, best first
+
+    Args:
+        q: Query vector, shape (d,)
+        M: Candidate vectors, shape (n, d)
+        k: Number of results to keep
+
+    Returns:
+        np.ndarray: Row indices into M, sorted by descending similarity
+    """
+    q = np.ascontiguousarray(q, dtype=np.float32)
+    M = np.ascontiguousarray(M, dtype=np.float32)
+    if M.shape[0] == 0 or k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    scores = _cosine_scores(q, M)
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def warm_up():
+    """Compile the numba kernel ahead of time so the first query doesn't pay for it"""
+    cosine_topk(np.ones(384, dtype=np.float32), np.ones((2, 384), dtype=np.float32), 1)
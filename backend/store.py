@@ -1,45 +1,133 @@
-from ollama_embeddings import OllamaEmbeddings
-from langchain_community.vectorstores import OpenSearchVectorSearch
+from ollama_embeddings import OllamaEmbeddings, Int8Embeddings, quantize_int8
+from rerank import cosine_topk
+from langchain.schema import Document
+from opensearchpy import AsyncOpenSearch, OpenSearch
+from typing import List
 from langchain.text_splitter import RecursiveCharacterTextSplitter
+import asyncio
 import re
 import requests
 import logging
+import threading
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
-# Embedding Model
-embedding_model = OllamaEmbeddings(model="all-minilm:22m")
+# Embedding Model (int8-quantized to match the "byte" knn_vector mapping)
+embedding_model = Int8Embeddings(OllamaEmbeddings(model="all-minilm:22m"))
 
 # OpenSearch configuration
 OPENSEARCH_URL = "http://localhost:9200"
 HTTP_AUTH = ("admin", "Opensearch@3")
 
-# Text splitter
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1200,
-    chunk_overlap=120,
-    separators=["\n\n", "\n", " ", ""]
+# Shared clients: the sync one for ingest (runs in worker threads), the async
+# one for query-time searches and chat history writes on the event loop
+client = OpenSearch(
+    hosts=[OPENSEARCH_URL],
+    http_auth=HTTP_AUTH,
+    use_ssl=False,
+    verify_certs=False,
+)
+async_client = AsyncOpenSearch(
+    hosts=[OPENSEARCH_URL],
+    http_auth=HTTP_AUTH,
+    use_ssl=False,
+    verify_certs=False,
 )
 
-def create_index_if_not_exists(index_name: str):
-    """Create OpenSearch index with proper mappings if it doesn't exist"""
-    
-    # Check if index exists
-    check_url = f"{OPENSEARCH_URL}/{index_name}"
-    
+# Text splitter: token-aware when tiktoken is available (~300 tokens is about
+# the old 1200 characters). Built lazily on first ingest and then reused:
+# loading cl100k_base may download it from the internet (set
+# TIKTOKEN_CACHE_DIR to a pre-populated directory on offline hosts), so
+# a slow or blocked fetch only delays ingest instead of the backend import.
+_text_splitter = None
+_text_splitter_lock = threading.Lock()
+
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    """Return the shared text splitter, building it on first use"""
+    global _text_splitter
+    with _text_splitter_lock:
+        if _text_splitter is None:
+            try:
+                _text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+                    encoding_name="cl100k_base",
+                    chunk_size=300,
+                    chunk_overlap=30,
+                    separators=["\n\n", "\n", " ", ""]
+                )
+            except Exception as e:
+                # tiktoken missing, or its encoding file could not be fetched
+                logger.warning(f"tiktoken unavailable ({e}), falling back to character-based text splitting")
+                _text_splitter = RecursiveCharacterTextSplitter(
+                    chunk_size=1200,
+                    chunk_overlap=120,
+                    separators=["\n\n", "\n", " ", ""]
+                )
+        return _text_splitter
+
+# Indices known to exist, filled at startup by load_known_indices and
+# whenever an index is created, so request paths only do a set lookup
+_known_indices = set()
+_known_indices_lock = threading.Lock()
+
+def load_known_indices():
+    """Fetch the names of all existing OpenSearch indices into _known_indices"""
     try:
-        response = requests.head(
-            check_url,
+        response = requests.get(
+            f"{OPENSEARCH_URL}/_cat/indices",
+            params={"format": "json", "h": "index"},
             auth=HTTP_AUTH,
-            verify=False
+            verify=False,
+            timeout=10
         )
-        
-        if response.status_code == 200:
-            logger.info(f"Index {index_name} already exists")
-            return
-            
+        response.raise_for_status()
+        indices = {entry["index"] for entry in response.json()}
+        with _known_indices_lock:
+            _known_indices.update(indices)
+        logger.info(f"Loaded {len(indices)} existing OpenSearch indices")
     except Exception as e:
-        logger.warning(f"Error checking index existence: {e}")
+        logger.warning(f"Error loading existing indices: {e}")
+
+def index_known(index_name: str) -> bool:
+    """Whether an index is already known to exist (a set lookup, safe on the event loop)"""
+    with _known_indices_lock:
+        return index_name in _known_indices
+
+def _check_knn_mapping(index_name: str):
+    """Raise ValueError unless an existing index maps vector_field as a byte knn_vector"""
+    response = requests.get(
+        f"{OPENSEARCH_URL}/{index_name}/_mapping",
+        auth=HTTP_AUTH,
+        verify=False,
+        timeout=10
+    )
+    response.raise_for_status()
+    properties = response.json().get(index_name, {}).get("mappings", {}).get("properties", {})
+    vector_field = properties.get("vector_field", {})
+    if vector_field.get("type") != "knn_vector" or vector_field.get("data_type") != "byte":
+        raise ValueError(
+            f"Index {index_name} exists without the byte knn_vector mapping on vector_field "
+            f"(found {vector_field or 'no vector_field'}); delete it so it can be recreated"
+        )
+
+def create_index_if_not_exists(index_name: str, verify: bool = False):
+    """
+    Create OpenSearch index with proper mappings if it doesn't exist
+    
+    Args:
+        index_name: Index to create
+        verify: If True, confirm against OpenSearch even when the index is in
+            _known_indices. Write paths use this: writing to a missing index
+            would auto-create it with a dynamic (non-knn) mapping.
+            
+    Raises:
+        ValueError: If the index could not be created or has the wrong mapping
+    """
+    
+    if not verify and index_known(index_name):
+        return
+    
+    index_url = f"{OPENSEARCH_URL}/{index_name}"
     
     # Create index with mapping
     mapping = {
@@ -55,7 +143,13 @@ def create_index_if_not_exists(index_name: str):
                 },
                 "vector_field": {
                     "type": "knn_vector",
-                    "dimension": 384
+                    "dimension": 384,
+                    "data_type": "byte",
+                    "method": {
+                        "engine": "lucene",
+                        "name": "hnsw",
+                        "space_type": "cosinesimil"
+                    }
                 },
                 "metadata": {
                     "type": "object"
@@ -66,55 +160,169 @@ def create_index_if_not_exists(index_name: str):
     
     try:
         response = requests.put(
-            check_url,
+            index_url,
             json=mapping,
             auth=HTTP_AUTH,
             verify=False,
-            headers={"Content-Type": "application/json"}
+            headers={"Content-Type": "application/json"},
+            timeout=30
         )
         
         if response.status_code in [200, 201]:
             logger.info(f"Successfully created index: {index_name}")
+        elif "resource_already_exists_exception" in response.text:
+            # Created earlier (e.g. at startup or by another worker); make sure
+            # it wasn't auto-created by a write without the knn mapping
+            _check_knn_mapping(index_name)
+            logger.info(f"Index {index_name} already exists")
         else:
-            logger.error(f"Failed to create index {index_name}: {response.text}")
+            raise ValueError(f"Failed to create index {index_name}: {response.text}")
             
     except Exception as e:
-        logger.error(f"Error creating index {index_name}: {e}")
-
-def get_doc_vector_store(tenant_id: str):
-    """Get vector store for documents of a specific tenant"""
-    index_name = f"doc_{tenant_id}"
-    
-    # Create index if it doesn't exist
-    create_index_if_not_exists(index_name)
-    
-    return OpenSearchVectorSearch(
-        opensearch_url=OPENSEARCH_URL,
-        embedding_function=embedding_model,
-        index_name=index_name,
-        text_field="text",
-        vector_field="vector_field",
-        http_auth=HTTP_AUTH,
-        verify_certs=False,
+        with _known_indices_lock:
+            _known_indices.discard(index_name)
+        error_msg = f"Error creating index {index_name}: {e}"
+        logger.error(error_msg)
+        raise ValueError(error_msg)
+    
+    with _known_indices_lock:
+        _known_indices.add(index_name)
+
+# Index layout version. v2 indices use the int8 "byte" cosinesimil mapping;
+# bumping it keeps new vectors out of indices created with an older mapping.
+INDEX_VERSION = "v2"
+
+def doc_index_name(tenant_id: str) -> str:
+    """Name of the document index for a tenant"""
+    return f"doc_{INDEX_VERSION}_{tenant_id}"
+
+def chat_history_index_name(tenant_id: str) -> str:
+    """Name of the chat history index for a tenant"""
+    return f"chat_history_{INDEX_VERSION}_{tenant_id}"
+
+async def asimilarity_search(index_name: str, query_vector: List[int], k: int, source: List[str] = None) -> List[dict]:
+    """
+    Run a kNN query against an index on the async OpenSearch client
+    
+    Args:
+        index_name: Index to search
+        query_vector: Query embedding (int8-quantized, like the stored vectors)
+        k: Number of hits to return
+        source: _source fields to return (default: text and metadata)
+        
+    Returns:
+        List of raw OpenSearch hits, most similar first
+    """
+    response = await async_client.search(
+        index=index_name,
+        body={
+            "size": k,
+            "query": {
+                "knn": {
+                    "vector_field": {
+                        "vector": query_vector,
+                        "k": k
+                    }
+                }
+            },
+            "_source": source or ["text", "metadata"]
+        }
     )
+    return response["hits"]["hits"]
 
-def get_chat_history_vector_store(tenant_id: str):
-    """Get vector store for chat history of a specific tenant"""
-    index_name = f"chat_history_{tenant_id}"
-    
-    # Create index if it doesn't exist
-    create_index_if_not_exists(index_name)
-    
-    return OpenSearchVectorSearch(
-        opensearch_url=OPENSEARCH_URL,
-        embedding_function=embedding_model,
-        index_name=index_name,
-        text_field="text",
-        vector_field="vector_field",
-        http_auth=HTTP_AUTH,
-        verify_certs=False,
+async def asimilarity_search_reranked(tenant_id: str, query_vector: List[float], k: int = 10, fetch_k: int = 50):
+    """
+    Search a tenant's documents, oversampling from the int8 HNSW index and
+    rescoring the candidates locally against the full-precision query vector
+    
+    Args:
+        tenant_id: Tenant identifier
+        query_vector: Full-precision (float) query embedding
+        k: Number of documents to return
+        fetch_k: Number of candidates fetched from OpenSearch
+        
+    Returns:
+        List of Documents, most similar first
+    """
+    # Index creation is left to ensure_indexes_exist, so nothing here blocks the event loop
+    index_name = doc_index_name(tenant_id)
+    if not any(query_vector):
+        # Embedding failed; a zero vector can't be searched in a cosinesimil field
+        logger.warning("No query embedding available, skipping document search")
+        return []
+    
+    hits = await asimilarity_search(
+        index_name,
+        quantize_int8([query_vector])[0].tolist(),
+        fetch_k,
+        source=["text", "metadata", "vector_field"]
     )
+    if not hits:
+        return []
+    
+    candidates = np.array([hit["_source"]["vector_field"] for hit in hits], dtype=np.float32)
+    order = cosine_topk(np.asarray(query_vector, dtype=np.float32), candidates, k)
+    
+    return [
+        Document(
+            page_content=hits[i]["_source"]["text"],
+            metadata=hits[i]["_source"].get("metadata", {})
+        )
+        for i in order
+    ]
 
+async def aadd_chat_history(tenant_id: str, text: str, metadata: dict):
+    """
+    Embed and index one chat turn through the shared async client
+    
+    Args:
+        tenant_id: Tenant identifier
+        text: Chat turn text to embed and store
+        metadata: Metadata stored alongside the text
+    """
+    vector = (await embedding_model.aembed_documents([text]))[0]
+    if not any(vector):
+        # Embedding failed; a zero vector can't be indexed in a cosinesimil field
+        logger.warning(f"No embedding for chat history of tenant {tenant_id}, not indexing it")
+        return
+    
+    # Writing to a missing index would auto-create it without the knn mapping
+    index_name = chat_history_index_name(tenant_id)
+    if not await async_client.indices.exists(index=index_name):
+        await asyncio.to_thread(create_index_if_not_exists, index_name, True)
+    
+    await async_client.index(
+        index=index_name,
+        body={
+            "text": text,
+            "vector_field": vector,
+            "metadata": metadata
+        },
+        refresh=True  # Searchable on the next question, as add_documents did
+    )
+
+async def close_async_client():
+    """Close the shared async OpenSearch client"""
+    await async_client.close()
+
+def _build_strip_table(pattern: "re.Pattern") -> dict:
+    """Translate table mapping every ASCII character matched by pattern to a space"""
+    return str.maketrans({chr(c): " " for c in range(128) if pattern.match(chr(c))})
+
+
+# Precompiled patterns for clean_text. The hyphen pattern anchors on a single
+# word character before the dash: (\w+)-\s+(\w+) gives the same result but
+# backtracks quadratically over long runs of word characters (e.g. OCR noise).
+_HYPHEN_RE = re.compile(r'(\w)-\s+(\w+)')
+_STRIP_RE = re.compile(r'[^\w\s.,;:!?\-]')
+_STRIP_SPECIAL_RE = re.compile(r'[^\w\s.,;:!?\-$%@#&+*=<>/]')
+_PUNCT_BEFORE_RE = re.compile(r'\s+([.,;:!?])')
+_PUNCT_AFTER_RE = re.compile(r'([.,;:!?])(?!\s)')
+_WS_RE = re.compile(r'\s+')
+
+# ASCII fast path: replace disallowed characters in a single str.translate pass
+_STRIP_TABLE = _build_strip_table(_STRIP_RE)
+_STRIP_SPECIAL_TABLE = _build_strip_table(_STRIP_SPECIAL_RE)
 
 def clean_text(text: str, preserve_special_chars: bool = False) -> str:
     """
@@ -129,20 +337,26 @@ def clean_text(text: str, preserve_special_chars: bool = False) -> str:
     
     # Remove extra whitespace and fix hyphenated words
     text = ' '.join(text.split())
-    text = re.sub(r'(\w+)-\s+(\w+)', r'\1\2', text)
+    text = _HYPHEN_RE.sub(r'\1\2', text)
     
     if preserve_special_chars:
         # Preserve common technical symbols
-        text = re.sub(r'[^\w\s.,;:!?\-$%@#&+*=<>/]', ' ', text)
+        if text.isascii():
+            text = text.translate(_STRIP_SPECIAL_TABLE)
+        else:
+            text = _STRIP_SPECIAL_RE.sub(' ', text)
     else:
         # Remove special characters except basic punctuation
-        text = re.sub(r'[^\w\s.,;:!?\-]', ' ', text)
+        if text.isascii():
+            text = text.translate(_STRIP_TABLE)
+        else:
+            text = _STRIP_RE.sub(' ', text)
     
     # Normalize whitespace around punctuation
-    text = re.sub(r'\s+([.,;:!?])', r'\1', text)
-    text = re.sub(r'([.,;:!?])(?!\s)', r'\1 ', text)
+    text = _PUNCT_BEFORE_RE.sub(r'\1', text)
+    text = _PUNCT_AFTER_RE.sub(r'\1 ', text)
     
     # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text)
+    text = _WS_RE.sub(' ', text)
     
     return text.strip()
\ No newline at end of file